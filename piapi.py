@@ -21,8 +21,9 @@ The Cisco Prime Infrastructure API is a REST API which exposes several resources
     * Service resources: expose some services that can modify the configuration of the software (e.g: modify/update an Access Point)
 
 The REST API is applying request rate limiting to avoid server's overloading. To bypass this limitation, especially
-when requesting data resources, the PIAPI uses multithreading requests (grequests library) with an hold time between
-chunk of requests. Please check the documentation to knowns more about rate limiting.
+when requesting data resources, the PIAPI sends concurrent requests from a pool of threads paced by a token bucket: at
+most 'concurrent_requests' requests are sent per hold time. Please check the documentation to knowns more about rate
+limiting.
 
 Also note that the piapi module only works with the JSON structure exposed by the REST API. The module doesn't support
 the default XML structure.
@@ -33,17 +34,53 @@ Please check your Cisco Prime REST API available at http://{server-name}/webacs/
 from __future__ import absolute_import
 import six.moves.urllib.parse
 import time
-import copy
 import hashlib
 import threading
-import six.moves.queue
 import json
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import contextlib
+import itertools
+import logging
+import sqlite3
 
 import requests
+import requests.adapters
 import requests.auth
 from six.moves import range
+from urllib3.util.retry import Retry
 
-#import grequests
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 """
 Default number of concurrent requests (check *Rate Limiting* of the API)
@@ -54,7 +91,8 @@ Default number of results per page (check *Rate Limiting* of the API)
 """
 DEFAULT_PAGE_SIZE = 1000
 """
-Default hold time in second to wait between group of concurrent request to avoid rate timiting (check *Rate Limiting* of the API)
+Default hold time in second during which at most 'concurrent_requests' requests are sent, refill time of the token
+bucket pacing the requests to avoid rate limiting (check *Rate Limiting* of the API)
 """
 DEFAULT_HOLD_TIME = 1
 """
@@ -65,6 +103,158 @@ DEFAULT_REQUEST_TIMEOUT = 300
 Default base URI of the Prime API
 """
 DEFAULT_API_URI = "/webacs/api/v3/"
+"""
+Default maximum number of data requests results kept in the cache
+"""
+DEFAULT_CACHE_SIZE = 500
+"""
+Default time in second during which a cached data request result is returned without contacting the REST API
+"""
+DEFAULT_CACHE_TTL = 300
+"""
+Default time in second to wait before retrying a rate limited request, when the REST API doesn't send a Retry-After
+header
+"""
+DEFAULT_RETRY_AFTER = 1
+"""
+Default maximum number of times a rate limited request is retried, the wait time is doubled after each retry
+"""
+DEFAULT_RATE_LIMIT_RETRIES = 5
+
+#  Error messages of the REST API by HTTP status code (check your REST API documentation for errors and return code)
+_STATUS_ERRORS = {
+    302: "Incorrect credentials provided",
+    401: "Unauthorized access",
+    403: "Forbidden access to the REST API",
+    404: "URL not found %(url)s",
+    406: "The Accept header sent in the request does not match a supported type",
+    415: "The Content-Type header sent in the request does not match a supported type",
+    429: "Too many requests sent to the REST API. Try again later (rate limiting)",
+    500: "An error has occured during the API invocation",
+    502: "The server is down or being upgraded",
+    503: "The servers are up, but overloaded with requests. Try again later (rate limiting)",
+}
+
+#  Maximum number of connections kept alive per host, beyond the threads of any sensible 'concurrent_requests'. Extra
+#  connections are still opened when needed, they are just not kept alive.
+_POOL_MAXSIZE = 100
+
+_logger = logging.getLogger(__name__)
+
+
+def _loads(content):
+    """
+    Deserialize a JSON document. msgspec or orjson is used when installed as they are several times faster than the
+    standard library on the large pages returned by the REST API.
+
+    Parameters
+    ----------
+    content : bytes
+        Raw JSON document (e.g. the body of an HTTP response).
+
+    Returns
+    -------
+    document : JSON structure
+        The deserialized JSON document.
+    """
+    return _decode(content)
+
+
+#  The JSON decoder is chosen once, a single msgspec Decoder is reused for all responses
+if msgspec is not None:
+    _decode = msgspec.json.Decoder().decode
+elif orjson is not None:
+    _decode = orjson.loads
+else:
+    _decode = json.loads
+
+
+def _cache_key(resource_name, params):
+    """
+    Compute the cache key of a data request. Parameters are serialized with sorted keys so that the key doesn't depend
+    on the insertion order of the params dictionary.
+
+    Parameters
+    ----------
+    resource_name : str
+        Data resource name requested.
+    params : dict
+        Parameters sent along the query.
+
+    Returns
+    -------
+    key : str
+        Resource name followed by the hexadecimal BLAKE2b digest of the request (e.g. "Clients:0123...").
+    """
+    request = {"r": resource_name, "p": params}
+    if orjson is not None:
+        serialized = orjson.dumps(request, default=str, option=orjson.OPT_SORT_KEYS)
+    else:
+        serialized = json.dumps(request, default=str, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return "%s:%s" % (resource_name, hashlib.blake2b(serialized, digest_size=16).hexdigest())
+
+
+def _with_fields(params, fields):
+    """
+    Add the '.field' parameter, selecting the fields of the entities returned by the REST API, to the parameters of a
+    data request.
+
+    Parameters
+    ----------
+    params : dict
+        Parameters sent along the query, not modified.
+    fields : str or list of str
+        Field or fields of the entities to be returned, all the fields if empty or None.
+
+    Returns
+    -------
+    params : dict
+        The parameters, along with the '.field' parameter if fields are given.
+    """
+    if not fields:
+        return params
+    #  A single field name would otherwise be joined character by character
+    if isinstance(fields, str):
+        fields = [fields]
+    return {**params, ".field": ",".join(fields)}
+
+
+def _imap_bounded(executor, fn, iterable, limit):
+    """
+    Lazily map a function over an iterable with an executor, keeping at most *limit* calls in flight. Unlike
+    *Executor.map*, which submits every item up front, a new item is only pulled from the iterable once a call is
+    done.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Executor running the calls.
+    fn : callable
+        Function called with each item of the iterable.
+    iterable : iterable
+        Items to map, consumed lazily.
+    limit : int
+        Maximum number of calls submitted to the executor at a time.
+
+    Returns
+    -------
+    results : generator
+        Results of the calls, in the order of the iterable.
+    """
+    iterator = iter(iterable)
+    pending = collections.deque()
+    try:
+        for item in itertools.islice(iterator, limit):
+            pending.append(executor.submit(fn, item))
+        while pending:
+            result = pending.popleft().result()
+            #  Refill the window before handing the result out so that the executor never starves
+            for item in itertools.islice(iterator, 1):
+                pending.append(executor.submit(fn, item))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
 
 
 class PIAPIError(Exception):
@@ -79,6 +269,23 @@ class PIAPIRequestError(PIAPIError):
     """
 
 
+class PIAPIRateLimited(PIAPIRequestError):
+    """
+    Error raised by the piapi module when a request is rejected by the rate limiting of the API (HTTP 429 or 503).
+
+    Parameters
+    ----------
+    message : str
+        Error message.
+    retry_after : float
+        Time in second to wait before sending the request again.
+    """
+
+    def __init__(self, message, retry_after):
+        super(PIAPIRateLimited, self).__init__(message)
+        self.retry_after = retry_after
+
+
 class PIAPICountError(PIAPIError):
     """
     Error raised by the piapi module when no result can be found for an API request.
@@ -91,6 +298,330 @@ class PIAPIResourceNotFound(PIAPIError):
     """
 
 
+def to_arrays(entities, columns, default=None):
+    """
+    Convert entities returned by a data request (list of JSON structures) to columns of NumPy arrays. Numeric fields
+    are stored contiguously instead of as one Python object per value, which reduces memory usage and allows
+    vectorized operations on the columns.
+
+    Parameters
+    ----------
+    entities : iterable of JSON structure
+        Entities returned by *PIAPI.request_data* or *PIAPI.request_data_iter*.
+    columns : dict
+        Columns to extract with keys as column name and values as a (path, dtype) tuple. The path is the dot separated
+        list of keys to the field in an entity (e.g. "clientsDTO.rssi") and the dtype the NumPy type of the column.
+    default : object (optional)
+        Value used for entities without the field. An error is raised for missing fields if not set (default: None).
+
+    Returns
+    -------
+    arrays : dict
+        NumPy arrays with keys as column name.
+    """
+    if numpy is None:
+        raise PIAPIError("NumPy is required to convert entities to arrays")
+    if not isinstance(entities, (list, tuple)):
+        entities = list(entities)
+
+    def field(entity, keys):
+        for key in keys:
+            try:
+                entity = entity[key]
+            except (KeyError, TypeError):
+                if default is None:
+                    raise PIAPIError("Field '%s' not found in entity" % ".".join(keys))
+                return default
+        return entity
+
+    arrays = {}
+    for name, (path, dtype) in columns.items():
+        keys = path.split(".")
+        arrays[name] = numpy.fromiter((field(entity, keys) for entity in entities), dtype=dtype, count=len(entities))
+    return arrays
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter. Tokens are refilled continuously at 'rate' tokens per second, up to 'capacity' tokens,
+    and each request consumes a token. Up to 'capacity' requests can be sent at once, then requests are sent as soon
+    as a token is available instead of waiting for a whole chunk of requests.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of tokens in the bucket (burst of requests).
+    rate : float
+        Number of tokens refilled per second, None for no rate limiting.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token from the bucket without waiting. The token is reserved even if the bucket is empty (negative
+        tokens) so that waiting requests are served in order.
+
+        Returns
+        -------
+        wait : float
+            Time in second to wait before the token can be used.
+        """
+        if self.rate is None:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return max(0, -self._tokens / self.rate)
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting until one is available.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def configure(self, capacity, rate):
+        """
+        Change the capacity and the rate of the bucket, the tokens already refilled are kept (up to the capacity).
+
+        Parameters
+        ----------
+        capacity : int
+            Maximum number of tokens in the bucket.
+        rate : float
+            Number of tokens refilled per second, None for no rate limiting.
+        """
+        with self._lock:
+            #  Tokens refilled so far are accounted at the current rate
+            now = time.monotonic()
+            if self.rate is not None:
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self.capacity = capacity
+            self.rate = rate
+            self._tokens = min(self._tokens, capacity)
+
+
+class LRUCache(object):
+    """
+    Bounded cache evicting the least recently used entries, used to store the results of data requests.
+
+    Each entry is fresh during a time to live. Stale entries are kept until evicted, along with the ETags of the
+    responses, so that they can be revalidated against the REST API instead of being downloaded again.
+
+    Parameters
+    ----------
+    maxsize : int (optional)
+        Maximum number of entries to keep (default: piapi.DEFAULT_CACHE_SIZE).
+    ttl : int (optional)
+        Time in second during which an entry is fresh (default: piapi.DEFAULT_CACHE_TTL).
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get an entry from the cache and mark it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry.
+
+        Returns
+        -------
+        entry : tuple or None
+            The (value, etag, fresh) tuple of the entry or None if the key is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        expires_at, etag, value = entry
+        return value, etag, time.time() < expires_at
+
+    def set(self, key, value, etag=None, ttl=None):
+        """
+        Store (or refresh) an entry in the cache, evicting the least recently used entries if needed.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry.
+        value : object
+            Value to be cached.
+        etag : JSON structure (optional)
+            ETags of the HTTP responses the value comes from (default: None).
+        ttl : int (optional)
+            Time in second during which the entry is fresh, instead of the cache's one (default: None).
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, etag, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self, prefix=None):
+        """
+        Remove all entries from the cache, or only the ones whose key starts with 'prefix'.
+
+        Parameters
+        ----------
+        prefix : str (optional)
+            Prefix of the keys of the entries to remove (default: None).
+        """
+        with self._lock:
+            if prefix is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(object):
+    """
+    Persistent cache stored in a SQLite database, used to store the results of data requests across processes. It
+    behaves like *LRUCache*: entries are fresh during a time to live, then revalidated with their ETags, and the least
+    recently used entries are evicted.
+
+    Results are stored as JSON documents. Several REST APIs can share the same database file, their entries being
+    separated by a namespace.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file, created if it doesn't exist.
+    maxsize : int (optional)
+        Maximum number of entries to keep in the namespace (default: piapi.DEFAULT_CACHE_SIZE).
+    ttl : int (optional)
+        Time in second during which an entry is fresh (default: piapi.DEFAULT_CACHE_TTL).
+    namespace : str (optional)
+        Namespace of the entries (default: "").
+    """
+
+    def __init__(self, path, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, namespace=""):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        #  The connection is shared by the threads of the paging requests, accesses are serialized by the lock
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS piapi_cache (namespace TEXT, key TEXT, "
+                                     "expires_at REAL, used_at REAL, etag BLOB, value BLOB, "
+                                     "PRIMARY KEY (namespace, key))")
+
+    def get(self, key):
+        """
+        Get an entry from the cache and mark it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry.
+
+        Returns
+        -------
+        entry : tuple or None
+            The (value, etag, fresh) tuple of the entry or None if the key is not cached.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT expires_at, etag, value FROM piapi_cache "
+                                           "WHERE namespace = ? AND key = ?", (self.namespace, key)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE piapi_cache SET used_at = ? WHERE namespace = ? AND key = ?",
+                                     (now, self.namespace, key))
+        expires_at, etag, value = row
+        return _loads(value), _loads(etag), now < expires_at
+
+    def set(self, key, value, etag=None, ttl=None):
+        """
+        Store (or refresh) an entry in the cache, evicting the least recently used entries if needed.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry.
+        value : JSON structure
+            Value to be cached.
+        etag : JSON structure (optional)
+            ETags of the HTTP responses the value comes from (default: None).
+        ttl : int (optional)
+            Time in second during which the entry is fresh, instead of the cache's one (default: None).
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if orjson is not None:
+            serialized, etag = orjson.dumps(value), orjson.dumps(etag)
+        else:
+            serialized = json.dumps(value, separators=(",", ":")).encode("utf-8")
+            etag = json.dumps(etag)
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO piapi_cache VALUES (?, ?, ?, ?, ?, ?)",
+                                     (self.namespace, key, now + ttl, now, etag, serialized))
+            self._connection.execute("DELETE FROM piapi_cache WHERE namespace = ? AND key NOT IN (SELECT key FROM "
+                                     "piapi_cache WHERE namespace = ? ORDER BY used_at DESC LIMIT ?)",
+                                     (self.namespace, self.namespace, self.maxsize))
+
+    def clear(self, prefix=None):
+        """
+        Remove all entries from the cache, or only the ones whose key starts with 'prefix'.
+
+        Parameters
+        ----------
+        prefix : str (optional)
+            Prefix of the keys of the entries to remove (default: None).
+        """
+        with self._lock:
+            if prefix is None:
+                self._connection.execute("DELETE FROM piapi_cache WHERE namespace = ?", (self.namespace,))
+                return
+            self._connection.execute("DELETE FROM piapi_cache WHERE namespace = ? AND substr(key, 1, ?) = ?",
+                                     (self.namespace, len(prefix), prefix))
+
+    def close(self):
+        """
+        Close the connection to the database.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM piapi_cache WHERE namespace = ? AND key = ?",
+                                            (self.namespace, key)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM piapi_cache WHERE namespace = ?",
+                                            (self.namespace,)).fetchone()[0]
+
+
 class PIAPI(object):
     """
     Interface with the Cisco Prime Infrastructure REST API.
@@ -101,10 +632,12 @@ class PIAPI(object):
         The base URL to get access to the API (e.g. https://{server}/webacs/v1/api/).
     verify : bool
         Whether or not to verify the server's SSL certificate.
-    cache : dict
+    cache : piapi.LRUCache or piapi.SQLiteCache
         Cache for all data requests already performed.
     session : requests.Session
         HTTP session that will be used as base for all interaction with the REST API.
+    http2 : bool
+        Whether or not the data pages are requested over HTTP/2.
 
     Parameters
     ----------
@@ -118,35 +651,96 @@ class PIAPI(object):
         Whether or not to verify the server's SSL certificate (default: True).
     virtual_domain : str (optional)
         The virtual domain used by all the request. Virtual domain are used as a filter (default: None).
+    cache_size : int (optional)
+        Maximum number of data requests results kept in the cache (default: piapi.DEFAULT_CACHE_SIZE).
+    cache_ttl : int (optional)
+        Time in second during which a cached result is returned without contacting the REST API
+        (default: piapi.DEFAULT_CACHE_TTL).
+    cache_path : str (optional)
+        Path of a SQLite database file where the results of data requests are persisted across processes instead of
+        being kept in memory (default: None).
+    http2 : bool (optional)
+        Whether or not to request the data pages over HTTP/2 with the httpx library, multiplexing all the concurrent
+        requests over a single connection (default: False).
     """
 
-    def __init__(self, url, username, password, verify=True, virtual_domain=None):
+    def __init__(self, url, username, password, verify=True, virtual_domain=None, cache_size=DEFAULT_CACHE_SIZE,
+                 cache_ttl=DEFAULT_CACHE_TTL, http2=False, cache_path=None):
         """
         Constructor of the PIAPI class.
         """
         self.base_url = six.moves.urllib.parse.urljoin(url, DEFAULT_API_URI)
         self.verify = verify
         self.virtual_domain = virtual_domain
-        self.cache = {}  # Caching is used for data resource with keys as checksum of resource's name+params from the request
+        if cache_path is not None:
+            #  Entries of different servers and users sharing the same database file are kept apart
+            self.cache = SQLiteCache(cache_path, cache_size, cache_ttl, namespace="%s@%s" % (username, self.base_url))
+        else:
+            self.cache = LRUCache(cache_size, cache_ttl)  # Caching is used for data resource with keys as checksum of resource's name+params from the request
 
         # Service resources holds all possible service resources with keys as service name
         # and hold the HTTP method + full url to request the service.
         self._service_resources = {}
         # Data resources holds all possible data resources with key as service name and value as full url access.
         self._data_resources = {}
+        # simdjson parsers are not thread-safe and only keep one document alive, hence one parser per thread.
+        self._local = threading.local()
+        # Data requests being sent with keys as cache key and value as the future result, to coalesce duplicates
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        # Thread pool shared by all the data requests to send the paging requests, grown on demand
+        self._executor = None
+        self._executor_size = 0
+        self._executor_lock = threading.Lock()
+        # Token bucket shared by the running data requests, so that concurrent data requests are paced together
+        # instead of each one bursting its own requests. It follows the strictest (capacity, rate) of the running data
+        # requests, listed in _bucket_limits.
+        self._bucket = TokenBucket(DEFAULT_CONCURRENT_REQUEST, DEFAULT_CONCURRENT_REQUEST / DEFAULT_HOLD_TIME)
+        self._bucket_limits = []
+        self._bucket_lock = threading.Lock()
+        # Only one rate limited request is retried at a time, the others wait for it instead of retrying all at once
+        self._retry_gate = threading.BoundedSemaphore(1)
+        # Same for the coroutines, with an asyncio lock bound to the event loop running them (see _get_async_retry_gate)
+        self._async_retry_gate = (None, None)
+        self._async_retry_gate_lock = threading.Lock()
 
         self.session = requests.Session()
         self.session.auth = requests.auth.HTTPBasicAuth(username, password)
+        # Only JSON is supported. Compressed responses are accepted by default (gzip, deflate and br when brotli is
+        # installed, see the 'fast' extra), JSON pages being highly compressible.
+        self.session.headers["Accept"] = "application/json"
+        # Keep the connections alive and pooled for the concurrent paging requests of request_data, so that
+        # consecutive pages reuse the same TLS sessions. The adapter is mounted once, remounting it would race with
+        # the requests being sent and drop the pooled connections.
+        # Requests rejected by an unavailable server (502, 504) are retried. Rate limited requests (429, 503) are not
+        # retried here, concurrent retries would hit the rate limiting again: they raise PIAPIRateLimited and are
+        # retried one at a time (see *PIAPI._retry_rate_limited*).
+        retries = Retry(total=5, backoff_factor=0.5, status_forcelist=[502, 504], respect_retry_after_header=False,
+                        raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=_POOL_MAXSIZE, max_retries=retries)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
-        # Disable HTTP keep_alive as advised by the API documentation
-        self.session.headers['connection'] = 'close'
+        # Data pages can be requested over HTTP/2, the concurrent requests are then multiplexed over one connection.
+        # The client is shared by the thread pool: if the server doesn't negotiate HTTP/2, the requests fall back to
+        # HTTP/1.1 and need a connection each.
+        self.http2 = http2
+        self._http2_client = None
+        self._http2_negotiated = None
+        if self.http2:
+            if httpx is None:
+                raise PIAPIError("The httpx library is required to use HTTP/2")
+            self._http2_client = httpx.Client(http2=True, auth=(username, password), verify=verify,
+                                              headers={"Accept": "application/json"},
+                                              limits=httpx.Limits(max_connections=_POOL_MAXSIZE,
+                                                                  max_keepalive_connections=_POOL_MAXSIZE))
 
         # Don't print warning message from request if not wanted
         if not self.verify:
             import warnings
             warnings.filterwarnings("ignore")
 
-    def _parse(self, response):
+    def _parse(self, response, lazy=False):
         """
         Parse a requests.Response object to check for potential errors using the HTTP status code.
         Please check your Cisco Prime Infrastructure REST API documentation for errors and return code.
@@ -155,6 +749,10 @@ class PIAPI(object):
         ----------
         response : requests.Response
             HTTP response from an HTTP requests.
+        lazy : bool (optional)
+            Whether or not to return a lazy simdjson document (when simdjson is installed) instead of fully
+            deserializing the response. The document is only valid until the next lazy parse in the same thread
+            (default: False).
 
         Returns
         -------
@@ -162,49 +760,276 @@ class PIAPI(object):
             The JSON structure from the response.
         """
         if response.status_code == 200:
-            response_json = response.json()
+            if lazy and simdjson is not None:
+                parser = getattr(self._local, "parser", None)
+                if parser is None:
+                    parser = self._local.parser = simdjson.Parser()
+                return parser.parse(response.content)
+            response_json = _loads(response.content)
             return response_json
-        elif response.status_code == 302:
-            raise PIAPIRequestError("Incorrect credentials provided")
         elif response.status_code == 400:
-            response_json = response.json()
+            response_json = _loads(response.content)
             raise PIAPIRequestError("Invalid request: %s" % response_json["errorDocument"]["message"])
-        elif response.status_code == 401:
-            raise PIAPIRequestError("Unauthorized access")
-        elif response.status_code == 403:
-            raise PIAPIRequestError("Forbidden access to the REST API")
-        elif response.status_code == 404:
-            raise PIAPIRequestError("URL not found %s" % response.url)
-        elif response.status_code == 406:
-            raise PIAPIRequestError("The Accept header sent in the request does not match a supported type")
-        elif response.status_code == 415:
-            raise PIAPIRequestError("The Content-Type header sent in the request does not match a supported type")
-        elif response.status_code == 500:
-            raise PIAPIRequestError("An error has occured during the API invocation")
-        elif response.status_code == 502:
-            raise PIAPIRequestError("The server is down or being upgraded")
-        elif response.status_code == 503:
-            raise PIAPIRequestError("The servers are up, but overloaded with requests. Try again later (rate limiting)")
-        else:
+
+        message = _STATUS_ERRORS.get(response.status_code)
+        if response.status_code in (429, 503):
+            retry_after = response.headers.get("Retry-After", "")
+            retry_after = float(retry_after) if retry_after.isdigit() else DEFAULT_RETRY_AFTER
+            raise PIAPIRateLimited(message, retry_after)
+        if message is None:
             raise PIAPIRequestError("Unknown Request Error, return code is %s" % response.status_code)
+        raise PIAPIRequestError(message % {"url": response.url})
+
+    def _get_json(self, url):
+        """
+        Request a resource of the REST API and parse its JSON response.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the resource.
+
+        Returns
+        -------
+        response_json : JSON structure
+            The JSON structure from the response.
+        """
+        return self._parse(self.session.get(url, verify=self.verify))
 
-    def _request_wrapper(self, queue, url, params, timeout):
+    def _page_fetcher(self, url, params, paging_size, timeout):
         """
-        Wrapper to requests used by each thread.
+        Build the function requesting the pages of a data resource. With requests, the request (URL, headers,
+        authentication) is prepared once and only the paging parameters are encoded for each page.
 
         Parameters
         ----------
-        queue : Queue.Queue
-            The Queue to write the response from the request in.
         url : str
-            The URL to be queried.
+            The URL of the data resource.
         params : dict
             A dictionary of parameters to pass to the request.
+        paging_size : int
+            Number of entries to include per page.
         timeout : int
             Timeout to wait for a response to the request.
+
+        Returns
+        -------
+        fetch_page : callable
+            Function taking the index of the first result of a page, and optionally the ETag of the page to be
+            revalidated, and returning the HTTP response of the page, streamed with requests (see
+            *PIAPI._iter_entities*).
+        """
+        base_params = {**params, ".full": "true"}
+        if self._http2_client is not None:
+            def fetch_page(first_result, etag=None):
+                page_params = {**base_params, ".firstResult": first_result, ".maxResults": paging_size}
+                headers = {"If-None-Match": etag} if etag else None
+                response = self._http2_client.get(url, params=page_params, headers=headers, timeout=timeout)
+                if self._http2_negotiated is None:
+                    self._http2_negotiated = response.http_version == "HTTP/2"
+                    if not self._http2_negotiated:
+                        _logger.warning("HTTP/2 not supported by the REST API, pages are requested over %s",
+                                        response.http_version)
+                return response
+            return fetch_page
+
+        template = self.session.prepare_request(requests.Request("GET", url, params=base_params))
+        settings = self.session.merge_environment_settings(template.url, {}, True, self.verify, None)
+
+        def fetch_page(first_result, etag=None):
+            prepared = template.copy()
+            prepared.prepare_url(template.url, {".firstResult": first_result, ".maxResults": paging_size})
+            if etag:
+                prepared.headers["If-None-Match"] = etag
+            return self.session.send(prepared, timeout=timeout, **settings)
+        return fetch_page
+
+    def _get_executor(self, max_workers):
+        """
+        Get the thread pool used to send the paging requests, creating a larger one if it has less than 'max_workers'
+        threads. Threads are started on demand and reused across data requests.
+
+        Parameters
+        ----------
+        max_workers : int
+            Minimum number of threads of the pool.
+
+        Returns
+        -------
+        executor : concurrent.futures.ThreadPoolExecutor
+            The thread pool.
+        """
+        with self._executor_lock:
+            if self._executor_size < max_workers:
+                #  The smaller pool is not shut down as other data requests may still be paging through it, its
+                #  threads exit once these requests are done and the pool is garbage collected.
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                                       thread_name_prefix="piapi")
+                self._executor_size = max_workers
+            return self._executor
+
+    @contextlib.contextmanager
+    def _pacing(self, concurrent_requests, hold):
+        """
+        Context manager giving the token bucket pacing the requests of a data request. The bucket is shared by all
+        the running data requests (threads and coroutines) of the instance and follows the strictest rate limiting
+        parameters among them, so that a data request can't burst its requests while other data requests are paced.
+        The parameters of a data request stop applying once it is done.
+
+        Parameters
+        ----------
+        concurrent_requests : int
+            Number of requests allowed at once.
+        hold : int
+            Time in second to refill 'concurrent_requests' tokens, 0 for no rate limiting.
+
+        Returns
+        -------
+        bucket : TokenBucket
+            The token bucket, not shared and without rate limiting if 'hold' is 0.
+        """
+        if not hold:
+            yield TokenBucket(concurrent_requests, None)
+            return
+        limits = (concurrent_requests, concurrent_requests / hold)
+        with self._bucket_lock:
+            self._bucket_limits.append(limits)
+            self._bucket.configure(*map(min, zip(*self._bucket_limits)))
+        try:
+            yield self._bucket
+        finally:
+            with self._bucket_lock:
+                self._bucket_limits.remove(limits)
+                if self._bucket_limits:
+                    self._bucket.configure(*map(min, zip(*self._bucket_limits)))
+
+    def _retry_rate_limited(self, function, *args):
+        """
+        Call a function sending a request, and retry it up to piapi.DEFAULT_RATE_LIMIT_RETRIES times while the request
+        is rate limited. Retries are serialized: a single rate limited request is retried at a time, after waiting the
+        time requested by the REST API, doubled after each retry.
+
+        Parameters
+        ----------
+        function : callable
+            Function sending the request and parsing its response.
+        *args
+            Arguments of the function.
+
+        Returns
+        -------
+        result : object
+            Result of the function.
+        """
+        try:
+            return function(*args)
+        except PIAPIRateLimited as error:
+            retry_after = error.retry_after
+        #  The gate is held until the request goes through, the other rate limited requests wait for it
+        with self._retry_gate:
+            for attempt in range(DEFAULT_RATE_LIMIT_RETRIES):
+                wait = retry_after * 2 ** attempt
+                _logger.warning("Request rate limited by the REST API, retrying in %s seconds", wait)
+                time.sleep(wait)
+                try:
+                    return function(*args)
+                except PIAPIRateLimited as error:
+                    if attempt == DEFAULT_RATE_LIMIT_RETRIES - 1:
+                        raise
+                    retry_after = error.retry_after
+
+    def _get_async_retry_gate(self):
+        """
+        Get the lock serializing the retries of rate limited requests sent from coroutines. The lock is shared by the
+        coroutines of the instance and created again when requests are sent from another event loop, an asyncio lock
+        being bound to a single event loop.
+
+        Returns
+        -------
+        retry_gate : asyncio.Lock
+            The lock of the running event loop.
         """
-        response = self.session.get(url, params=params, verify=self.verify, timeout=timeout)
-        queue.put(response)
+        loop = asyncio.get_running_loop()
+        with self._async_retry_gate_lock:
+            gate_loop, retry_gate = self._async_retry_gate
+            if gate_loop is not loop:
+                retry_gate = asyncio.Lock()
+                self._async_retry_gate = (loop, retry_gate)
+            return retry_gate
+
+    async def _retry_rate_limited_async(self, function, *args):
+        """
+        Coroutine awaiting a coroutine function sending a request, and retrying it while the request is rate limited.
+        Retries are serialized as with *PIAPI._retry_rate_limited*.
+
+        Parameters
+        ----------
+        function : coroutine function
+            Coroutine function sending the request and parsing its response.
+        *args
+            Arguments of the function.
+
+        Returns
+        -------
+        result : object
+            Result of the function.
+        """
+        try:
+            return await function(*args)
+        except PIAPIRateLimited as error:
+            retry_after = error.retry_after
+        async with self._get_async_retry_gate():
+            for attempt in range(DEFAULT_RATE_LIMIT_RETRIES):
+                wait = retry_after * 2 ** attempt
+                _logger.warning("Request rate limited by the REST API, retrying in %s seconds", wait)
+                await asyncio.sleep(wait)
+                try:
+                    return await function(*args)
+                except PIAPIRateLimited as error:
+                    if attempt == DEFAULT_RATE_LIMIT_RETRIES - 1:
+                        raise
+                    retry_after = error.retry_after
+
+    def close(self):
+        """
+        Close the HTTP connections to the REST API and stop the threads used for the paging requests.
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+                self._executor_size = 0
+        self.session.close()
+        if isinstance(self.cache, SQLiteCache):
+            self.cache.close()
+        if self._http2_client is not None:
+            self._http2_client.close()
+
+    def _iter_entities(self, response):
+        """
+        Iterate over the entities of a data page. When ijson is installed, the entities are parsed incrementally from
+        the response stream instead of deserializing the whole page in memory.
+
+        Parameters
+        ----------
+        response : requests.Response or httpx.Response
+            HTTP response of a data page, requested with stream=True (HTTP/2 responses are never streamed).
+
+        Returns
+        -------
+        entities : iterator of JSON structure
+            The entities of the page.
+        """
+        try:
+            if response.status_code != 200 or ijson is None or not isinstance(response, requests.Response):
+                for entity in self._parse(response)["queryResponse"].get("entity", []):
+                    yield entity
+                return
+            response.raw.decode_content = True
+            for entity in ijson.items(response.raw, "queryResponse.entity.item", use_float=True):
+                yield entity
+        finally:
+            response.close()
 
     @property
     def resources(self):
@@ -213,46 +1038,56 @@ class PIAPI(object):
         """
         return self.data_resources + self.service_resources
 
-    @property
+    @functools.cached_property
     def data_resources(self):
         """
-        List of all available data resources, meaning resources that return data.
+        List of all available data resources, meaning resources that return data. The list is requested once per
+        PIAPI instance.
         """
-        if self._data_resources:
-            return list(self._data_resources.keys())
-
         data_resources_url = six.moves.urllib.parse.urljoin(self.base_url, "data.json")
-        response = self.session.get(data_resources_url, verify=self.verify)
-        response_json = self._parse(response)
+        response_json = self._retry_rate_limited(self._get_json, data_resources_url)
         for entry in response_json["queryResponse"]["entityType"]:
             self._data_resources[entry["$"]] = "%s.json" % entry["@url"]
 
         return list(self._data_resources.keys())
 
-    @property
+    @functools.cached_property
     def service_resources(self):
         """
-        List of all available service resources, meaning resources that modify the NMS.
+        List of all available service resources, meaning resources that modify the NMS. The list is requested once per
+        PIAPI instance.
         """
-        if self._service_resources:
-            return list(self._service_resources.keys())
-
         service_resources_url = six.moves.urllib.parse.urljoin(self.base_url, "op.json")
-        response = self.session.get(service_resources_url, verify=self.verify)
-        response_json = self._parse(response)
+        response_json = self._retry_rate_limited(self._get_json, service_resources_url)
         for entry in response_json["queryResponse"]["operation"]:
             self._service_resources[entry["$"]] = {"method": entry["@httpMethod"], "url": six.moves.urllib.parse.urljoin(self.base_url, "op/%s.json" % entry["@path"])}
 
         return list(self._service_resources.keys())
 
-    def request_data(self, resource_name, params={}, check_cache=True, timeout=DEFAULT_REQUEST_TIMEOUT, paging_size=DEFAULT_PAGE_SIZE, concurrent_requests=DEFAULT_CONCURRENT_REQUEST, hold=DEFAULT_HOLD_TIME):
+    @functools.cached_property
+    def _data_resource_names(self):
+        """
+        Set of all available data resources, for constant time membership tests.
+        """
+        return frozenset(self.data_resources)
+
+    @functools.cached_property
+    def _service_resource_names(self):
+        """
+        Set of all available service resources, for constant time membership tests.
+        """
+        return frozenset(self.service_resources)
+
+    def request_data(self, resource_name, params=None, check_cache=True, timeout=DEFAULT_REQUEST_TIMEOUT, paging_size=DEFAULT_PAGE_SIZE, concurrent_requests=DEFAULT_CONCURRENT_REQUEST, hold=DEFAULT_HOLD_TIME,
+                     cache_ttl=None, fields=None):
         """
         Request a 'resource_name' resource from the REST API. The request can be tuned with filtering, sorting options.
         Check the REST API documentation for available filters by resource.
 
         To bypass rate limiting feature of the API you can tune paging_size, concurrent_requests and hold_time parameters.
-        'X' concurrent requests will be sent as chunk and we will wait the hold time before sending the next chunk until
-        all resource_name have been retrieved.
+        At most 'X' concurrent requests are sent at a rate of 'X' requests per hold time (token bucket) until all
+        resource_name have been retrieved. The token bucket is shared by the running data requests of the instance and
+        follows the strictest concurrent_requests and hold among them, a hold of 0 disables the pacing.
 
         Parameters
         ----------
@@ -269,62 +1104,328 @@ class PIAPI(object):
         concurrent_requests : int (optional)
             Number of parallel requests to make (default : piapi.DEFAULT_CONCURRENT_REQUEST).
         hold : int (optional)
-            Hold time in second to wait between chunk of concurrent requests to avoid rate limiting (default : piapi.DEFAULT_HOLD_TIME).
+            Time in second during which at most 'concurrent_requests' requests are sent to avoid rate limiting, 0 to
+            disable the rate limiting (default : piapi.DEFAULT_HOLD_TIME).
+        cache_ttl : int (optional)
+            Time in second during which the result is returned from the cache, instead of the PIAPI's cache_ttl
+            (default : None).
+        fields : str or list of str (optional)
+            Fields of the entities to be returned by the REST API ('.field' parameter), all the fields if not set.
+            Fields are part of the cache key, a result with fields is cached apart from the full result
+            (default : None).
+
+        Returns
+        -------
+        results : list of JSON structure
+            Data results from the requested resources. Each call returns its own list, which can be modified without
+            altering the cached result, but the entities are shared with the cache and must not be modified.
+        """
+        params = {} if params is None else params
+        params = _with_fields(params, fields)
+        if resource_name not in self._data_resource_names:
+            raise PIAPIResourceNotFound("Data Resource '%s' not found in the API, check 'data_resources' property "
+                                        "for a list of available resource_name" % resource_name)
+
+        #  Check the cache to see if the couple (resource + parameters) already exists (using BLAKE2b hash of resource_name and params)
+        #  The cached list is shared by all the callers, each caller gets its own copy of the list
+        hash_cache = _cache_key(resource_name, params)
+        cached = self.cache.get(hash_cache) if check_cache else None
+        if cached is not None and cached[2]:
+            return list(cached[0])
+        if not check_cache:
+            return list(self._fetch_data(resource_name, params, hash_cache, None, timeout, paging_size,
+                                         concurrent_requests, hold, cache_ttl))
+
+        #  Coalesce concurrent identical requests: only the first one is sent, the others wait for its result
+        with self._inflight_lock:
+            inflight = self._inflight.get(hash_cache)
+            if inflight is None:
+                future = self._inflight[hash_cache] = concurrent.futures.Future()
+        if inflight is not None:
+            return list(inflight.result())
+
+        try:
+            results = self._fetch_data(resource_name, params, hash_cache, cached, timeout, paging_size,
+                                       concurrent_requests, hold, cache_ttl)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(results)
+            return list(results)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[hash_cache]
+
+    def _fetch_data(self, resource_name, params, hash_cache, cached, timeout, paging_size, concurrent_requests, hold,
+                    cache_ttl):
+        """
+        Request all the pages of a data resource and store the results in the cache. Parameters correspond to the ones
+        from *PIAPI.request_data*.
+
+        Parameters
+        ----------
+        hash_cache : str
+            Cache key of the request.
+        cached : tuple or None
+            Stale (value, etag, fresh) cache entry of the request, revalidated page by page with its ETags if any.
 
         Returns
         -------
         results : JSON structure
             Data results from the requested resources.
         """
-        if resource_name not in self.data_resources:
+        #  Stale results are revalidated page by page: the ETag of a page only tells whether this page changed. The
+        #  cached ETags are stored along with the paging size, the pages being different with another paging size.
+        cached_results, page_etags = [], []
+        if cached is not None:
+            cached_results, cached_etags, _ = cached
+            if cached_etags and cached_etags[0] == paging_size:
+                page_etags = cached_etags[1]
+
+        def cached_etag(first_result):
+            index = first_result // paging_size
+            return page_etags[index] if index < len(page_etags) else None
+
+        url = self._data_resources[resource_name]
+        fetch_page = self._page_fetcher(url, params, paging_size, timeout)
+
+        def fetch_first_page():
+            bucket.acquire()
+            etag = cached_etag(0)
+            response = fetch_page(0, etag)
+            #  The response is closed once parsed, or rate limited, before being retried
+            try:
+                if response.status_code == 304 and etag:
+                    return response, etag, None
+                return response, response.headers.get("ETag"), self._parse(response)["queryResponse"]
+            finally:
+                response.close()
+
+        def fetch_paced_page(first_result):
+            bucket.acquire()
+            etag = cached_etag(first_result)
+            response = fetch_page(first_result, etag)
+            if response.status_code == 304 and etag:
+                response.close()
+                return etag, cached_results[first_result:first_result + paging_size]
+            #  Entities are parsed while the page is downloaded (with ijson), the raw page is never kept in memory
+            return response.headers.get("ETag"), list(self._iter_entities(response))
+
+        def fetch_page_with_retry(first_result):
+            return self._retry_rate_limited(fetch_paced_page, first_result)
+
+        #  Get the first page along with the total number of entries for the request. All the requests, retries
+        #  included, are paced by the same token bucket as concurrent data requests.
+        with self._pacing(concurrent_requests, hold) as bucket:
+            response, etag, query_response = self._retry_rate_limited(fetch_first_page)
+            if query_response is None:
+                #  The first page, holding the count of entries, did not change: the number of pages is the cached one
+                results = cached_results[:paging_size]
+                count_entry = len(page_etags) * paging_size
+            else:
+                count_entry = int(query_response["@count"])
+                if count_entry <= 0:
+                    raise PIAPICountError("No result found for the query %s with params %s" % (response.url, params))
+                results = query_response.get("entity", [])
+            etags = [etag]
+
+            #  Keep at most 'concurrent_requests' pages in flight, pages are merged in order as soon as they are
+            #  retrieved. No paging request is sent if all the entries fit in the first page.
+            if count_entry > paging_size:
+                executor = self._get_executor(concurrent_requests)
+                pages = _imap_bounded(executor, fetch_page_with_retry, range(paging_size, count_entry, paging_size),
+                                      concurrent_requests)
+                for etag, entities in pages:
+                    etags.append(etag)
+                    results.extend(entities)
+        self.cache.set(hash_cache, results, [paging_size, etags] if any(etags) else None, cache_ttl)
+        return results
+
+    async def request_data_async(self, resource_name, params=None, check_cache=True, timeout=DEFAULT_REQUEST_TIMEOUT,
+                                 paging_size=DEFAULT_PAGE_SIZE, concurrent_requests=DEFAULT_CONCURRENT_REQUEST,
+                                 hold=DEFAULT_HOLD_TIME, cache_ttl=None, fields=None):
+        """
+        Coroutine requesting a 'resource_name' resource from the REST API, to be used from asyncio code. Pages are
+        requested with the httpx library over HTTP/2 and multiplexed on a single event loop instead of a pool of
+        threads. Parameters correspond to the ones from *PIAPI.request_data*.
+
+        Results are stored in and returned from the cache, but stale results are not revalidated and concurrent
+        identical requests are not coalesced.
+
+        Parameters
+        ----------
+        resource_name : str
+            Data resource name to be requested.
+        params : dict (optional)
+            Additional parameters to be sent along the query for filtering, sorting,... (default : empty dict).
+        check_cache : bool (optional)
+            Whether or not to check the cache instead of performing a call against the REST API.
+        timeout : int (optional)
+            Time to wait for a response from the REST API (default : piapi.DEFAULT_REQUEST_TIMEOUT)
+        paging_size : int (optional)
+            Number of entries to include per page (default : piapi.DEFAULT_PAGE_SIZE).
+        concurrent_requests : int (optional)
+            Number of parallel requests to make (default : piapi.DEFAULT_CONCURRENT_REQUEST).
+        hold : int (optional)
+            Time in second during which at most 'concurrent_requests' requests are sent to avoid rate limiting, 0 to
+            disable the rate limiting (default : piapi.DEFAULT_HOLD_TIME).
+        cache_ttl : int (optional)
+            Time in second during which the result is returned from the cache, instead of the PIAPI's cache_ttl
+            (default : None).
+        fields : str or list of str (optional)
+            Fields of the entities to be returned by the REST API ('.field' parameter), all the fields if not set.
+            Fields are part of the cache key, a result with fields is cached apart from the full result
+            (default : None).
+
+        Returns
+        -------
+        results : list of JSON structure
+            Data results from the requested resources, in a list of its own (see *PIAPI.request_data*).
+        """
+        if httpx is None:
+            raise PIAPIError("The httpx library is required for asynchronous requests")
+        params = {} if params is None else params
+        params = _with_fields(params, fields)
+        if resource_name not in self._data_resource_names:
+            raise PIAPIResourceNotFound("Data Resource '%s' not found in the API, check 'data_resources' property "
+                                        "for a list of available resource_name" % resource_name)
+
+        hash_cache = _cache_key(resource_name, params)
+        cached = self.cache.get(hash_cache) if check_cache else None
+        if cached is not None and cached[2]:
+            return list(cached[0])
+
+        url = self._data_resources[resource_name]
+        auth = (self.session.auth.username, self.session.auth.password)
+        with self._pacing(concurrent_requests, hold) as bucket:
+            async with httpx.AsyncClient(http2=True, auth=auth, verify=self.verify, timeout=timeout,
+                                         headers={"Accept": "application/json"},
+                                         limits=httpx.Limits(max_connections=concurrent_requests)) as client:
+                #  At most 'concurrent_requests' pages are in flight, sent at the rate allowed by a token bucket
+                semaphore = asyncio.Semaphore(concurrent_requests)
+
+                async def send_page(first_result):
+                    page_params = {**params, ".full": "true", ".firstResult": first_result, ".maxResults": paging_size}
+                    async with semaphore:
+                        await asyncio.sleep(bucket.reserve())
+                        page_response = await client.get(url, params=page_params)
+                    return page_response, self._parse(page_response)["queryResponse"]
+
+                async def fetch_page(first_result):
+                    #  Rate limited pages are retried one at a time, by all the coroutines of the instance
+                    return await self._retry_rate_limited_async(send_page, first_result)
+
+                async def fetch_entities(first_result):
+                    page_response, page_query_response = await fetch_page(first_result)
+                    return page_response.headers.get("ETag"), page_query_response.get("entity", [])
+
+                #  Get the first page along with the total number of entries for the request
+                response, query_response = await fetch_page(0)
+                count_entry = int(query_response["@count"])
+                if count_entry <= 0:
+                    raise PIAPICountError("No result found for the query %s with params %s" % (response.url, params))
+
+                pages = await asyncio.gather(*(fetch_entities(first_result)
+                                               for first_result in range(paging_size, count_entry, paging_size)))
+
+        results = list(query_response.get("entity", []))
+        etags = [response.headers.get("ETag")]
+        for etag, entities in pages:
+            etags.append(etag)
+            results.extend(entities)
+        #  ETags of all the pages are cached so that the result can be revalidated by *PIAPI.request_data*
+        self.cache.set(hash_cache, results, [paging_size, etags] if any(etags) else None, cache_ttl)
+        return list(results)
+
+    def request_data_iter(self, resource_name, params=None, *, timeout=DEFAULT_REQUEST_TIMEOUT,
+                          paging_size=DEFAULT_PAGE_SIZE, concurrent_requests=DEFAULT_CONCURRENT_REQUEST,
+                          hold=DEFAULT_HOLD_TIME, virtual_domain=None, fields=None):
+        """
+        Iterate over the entities of a 'resource_name' resource from the REST API. Unlike *PIAPI.request_data*, pages
+        are requested one after the other and their entities are yielded while the page is being downloaded, so that
+        only one page (one entity with ijson installed) is kept in memory. Results are not cached.
+
+        The resource and the number of entries are checked when this method is called, before iterating. Requests are
+        paced by the token bucket shared with the other data requests and rate limited requests are retried as for
+        *PIAPI.request_data*.
+
+        Arguments after 'params' are keyword-only, this method having no 'check_cache' argument unlike
+        *PIAPI.request_data*.
+
+        Parameters
+        ----------
+        resource_name : str
+            Data resource name to be requested.
+        params : dict (optional)
+            Additional parameters to be sent along the query for filtering, sorting,... (default : empty dict).
+        timeout : int (optional)
+            Time to wait for a response from the REST API (default : piapi.DEFAULT_REQUEST_TIMEOUT)
+        paging_size : int (optional)
+            Number of entries to include per page (default : piapi.DEFAULT_PAGE_SIZE).
+        concurrent_requests : int (optional)
+            Number of requests allowed at once by the token bucket (default : piapi.DEFAULT_CONCURRENT_REQUEST).
+        hold : int (optional)
+            Time in second during which at most 'concurrent_requests' requests are sent to avoid rate limiting, 0 to
+            disable the rate limiting (default : piapi.DEFAULT_HOLD_TIME).
+        virtual_domain : str (optional)
+            Name of the virtual domain to send the request for (default : None).
+        fields : str or list of str (optional)
+            Fields of the entities to be returned by the REST API ('.field' parameter), all the fields if not set
+            (default : None).
+
+        Returns
+        -------
+        entities : iterator of JSON structure
+            Entities of the requested resource.
+        """
+        params = {} if params is None else params
+        params = _with_fields(params, fields)
+        if resource_name not in self._data_resource_names:
             raise PIAPIResourceNotFound("Data Resource '%s' not found in the API, check 'data_resources' property "
                                         "for a list of available resource_name" % resource_name)
 
-        #  Check the cache to see if the couple (resource + parameters) already exists (using SHA256 hash of resource_name and params)
-        #  hash_cache = hashlib.sha256(b"%s%s" % (resource_name, params)).hexdigest()
-        #   if check_cache and hash_cache in self.cache:
-        #      return self.cache[hash_cache]
+        virtual_domain = virtual_domain or self.virtual_domain
+        if virtual_domain:
+            params = {**params, "_ctx.domain": virtual_domain}
+
+        url = self._data_resources[resource_name]
+        probe_params = {**params, ".firstResult": 0, ".maxResults": 1}
+
+        def probe(bucket):
+            bucket.acquire()
+            with self.session.get(url, params=probe_params, verify=self.verify, timeout=timeout) as probe_response:
+                return probe_response, int(self._parse(probe_response, lazy=True)["queryResponse"]["@count"])
 
-        #  Get total number of entries for the request
-        response = self.session.get(self._data_resources[resource_name], params=params, timeout=timeout)
-        self._parse(response)
-        count_entry = int(response.json()["queryResponse"]["@count"])
+        with self._pacing(concurrent_requests, hold) as bucket:
+            response, count_entry = self._retry_rate_limited(probe, bucket)
         if count_entry <= 0:
             raise PIAPICountError("No result found for the query %s with params %s" % (response.url, params))
 
-        #  Create the necessary requests with paging to avoid rate limiting
-        paging_requests = []
-        queue = six.moves.queue.Queue()
-        for first_result in range(0, count_entry, paging_size):
-            params_copy = copy.deepcopy(params)
-            params_copy.update({".full": "true", ".firstResult": first_result, ".maxResults": paging_size})
-            #paging_requests.append(grequests.get(self._data_resources[resource_name], session=self.session, params=params_copy, verify=self.verify, timeout=timeout))
-            paging_requests.append(threading.Thread(None, self._request_wrapper, args=(queue,
-                                                                                       self._data_resources[resource_name],
-                                                                                       params_copy,
-                                                                                       timeout)))
-
-        #  Create chunks from the previous list of requests to avoid rate limiting (we hold between each chunk)
-        chunk_requests = [paging_requests[x:x+concurrent_requests] for x in range(0, len(paging_requests), concurrent_requests)]
-
-        #  Bulk query the chunk pages by waiting between each chunk to avoid rate limiting
-        responses = []
-        for chunk_request in chunk_requests:
-            #responses += grequests.map(chunk_request)
-            for request in chunk_request:
-                request.start()
-            for request in chunk_request:
-                request.join()
-                responses.append(queue.get())
-            time.sleep(hold)
-
-        #  Parse the results of the previous queries
-        results = []
-        for response in responses:
-            response_json = self._parse(response)
-            results += response_json["queryResponse"]["entity"]
-        #  self.cache[hash_cache] = results
-        return results
+        fetch_page = self._page_fetcher(url, params, paging_size, timeout)
+
+        def fetch_paced_page(bucket, first_result):
+            bucket.acquire()
+            page_response = fetch_page(first_result)
+            #  Errors (rate limiting included) are raised before any entity of the page is yielded
+            if page_response.status_code != 200:
+                try:
+                    self._parse(page_response)
+                finally:
+                    page_response.close()
+            return page_response
+
+        def iter_entities():
+            #  The pacing of the pages applies while the entities are iterated
+            with self._pacing(concurrent_requests, hold) as bucket:
+                for first_result in range(0, count_entry, paging_size):
+                    response = self._retry_rate_limited(fetch_paced_page, bucket, first_result)
+                    for entity in self._iter_entities(response):
+                        yield entity
+
+        #  The generator is returned instead of being the method itself, so that the checks above are not delayed
+        #  until the first entity is requested
+        return iter_entities()
 
     def request_service(self, resource_name, params=None, timeout=DEFAULT_REQUEST_TIMEOUT):
         """
@@ -344,7 +1445,7 @@ class PIAPI(object):
         results : JSON structure
             Data results from the requested resources.
         """
-        if resource_name not in self.service_resources:
+        if resource_name not in self._service_resource_names:
             raise PIAPIResourceNotFound("Service Resource '%s' not found in the API, check 'service_resources' property "
                                         "for a list of available actions" % resource_name)
 
@@ -353,15 +1454,40 @@ class PIAPI(object):
         headers = {'Content-Type':'application/json'}
         # if the HTTP method is 'GET', use the params args of request, otherwise use data (POST, DELETE, PUT)
         if method == "GET":
-            response = self.session.request(method, url, params=params, verify=self.verify, timeout=timeout)
+            request_kwargs = {"params": params}
         elif method == "PUT" or method == "POST":
-            response = self.session.request(method, url, data=json.dumps(params), headers=headers, verify=self.verify, timeout=timeout)
+            request_kwargs = {"data": json.dumps(params), "headers": headers}
         else:
-            response = self.session.request(method, url, data=params, verify=self.verify, timeout=timeout)
-        return self._parse(response)
+            request_kwargs = {"data": params}
+
+        def send():
+            response = self.session.request(method, url, verify=self.verify, timeout=timeout, **request_kwargs)
+            return self._parse(response)
+
+        try:
+            # Rate limited requests are retried, unless the method is not idempotent (POST)
+            if method in Retry.DEFAULT_ALLOWED_METHODS:
+                return self._retry_rate_limited(send)
+            return send()
+        finally:
+            # Services other than GET modify the NMS, cached data may not be accurate anymore
+            if method != "GET":
+                self.invalidate()
+
+    def invalidate(self, resource_name=None):
+        """
+        Remove the cached results of a data resource, or of all data resources, so that they are requested again.
+
+        Parameters
+        ----------
+        resource_name : str (optional)
+            Data resource whose results are removed, all results are removed if not set (default : None).
+        """
+        self.cache.clear(None if resource_name is None else "%s:" % resource_name)
 
-    def request(self, resource, params={}, virtual_domain=None, check_cache=True, timeout=DEFAULT_REQUEST_TIMEOUT, paging_size=DEFAULT_PAGE_SIZE,
-                concurrent_requests=DEFAULT_CONCURRENT_REQUEST, hold=DEFAULT_HOLD_TIME):
+    def request(self, resource, params=None, virtual_domain=None, check_cache=True, timeout=DEFAULT_REQUEST_TIMEOUT, paging_size=DEFAULT_PAGE_SIZE,
+                concurrent_requests=DEFAULT_CONCURRENT_REQUEST, hold=DEFAULT_HOLD_TIME, cache_ttl=None,
+                fields=None):
         """
         Generic request for either data or services resources. The parameters correspond to the ones from
         *PIAPI.request_data* or *PIAPI.request_action*.
@@ -383,30 +1509,48 @@ class PIAPI(object):
         concurrent_requests : int (optional)
             Number of parallel requests to make (default : piapi.DEFAULT_CONCURRENT_REQUEST).
         hold : int (optional)
-            Hold time in second to wait between chunk of concurrent requests to avoid rate limiting (default : piapi.DEFAULT_HOLD_TIME).
+            Time in second during which at most 'concurrent_requests' requests are sent to avoid rate limiting, 0 to
+            disable the rate limiting (default : piapi.DEFAULT_HOLD_TIME).
+        cache_ttl : int (optional)
+            Time in second during which the result is returned from the cache, instead of the PIAPI's cache_ttl
+            (default : None).
+        fields : str or list of str (optional)
+            Fields of the entities to be returned by the REST API for data resources, all the fields if not set
+            (default : None).
 
         Returns
         -------
         results : JSON structure
             Data results from the requested resources.
         """
+        # Copy the parameters, the virtual domain must not leak into the caller's dictionary
+        params = {} if params is None else dict(params)
         virtual_domain = virtual_domain or self.virtual_domain
         if virtual_domain:
             params["_ctx.domain"] = virtual_domain
 
-        if resource in self.data_resources:
-            return self.request_data(resource, params, check_cache, timeout, paging_size, concurrent_requests, hold)
-        elif resource in self.service_resources:
+        if resource in self._data_resource_names:
+            return self.request_data(resource, params, check_cache, timeout, paging_size, concurrent_requests, hold,
+                                     cache_ttl, fields)
+        elif resource in self._service_resource_names:
             return self.request_service(resource, params, timeout)
 
     def __getattr__(self, item):
         """
-        Magic method used to render all resources as class attribute
+        Magic method used to render all resources as class attribute. The attribute is a shortcut of *PIAPI.request*
+        for the resource (e.g. `api.Clients(params=...)`), the REST API is only requested when it is called.
 
         item : str
             Name of the resource to be found
         """
-        if item in self.resources:
-            return self.request(item)
+        # Private and special attributes (e.g. looked up by copy, pickle or hasattr) are never resources, don't
+        # request the REST API for them
+        if item.startswith("_"):
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, item))
+        if item in self._data_resource_names or item in self._service_resource_names:
+            #  Stored on the instance so that the next lookups don't go through __getattr__
+            request = functools.partial(self.request, item)
+            object.__setattr__(self, item, request)
+            return request
         raise AttributeError("'%s' resource not found in the REST API" % item)
 
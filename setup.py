@@ -42,7 +42,14 @@ setup(
         "Topic :: Internet :: WWW/HTTP :: Dynamic Content",
         "Topic :: Software Development :: Libraries :: Python Modules"
     ],
+	python_requires='>=3.8',
 	install_requires=[
-		'requests', 'six'
+		'requests', 'six', 'urllib3'
 	],
+	extras_require={
+		'fast': ['msgspec', 'orjson', 'pysimdjson', 'brotli'],
+		'stream': ['ijson'],
+		'numpy': ['numpy'],
+		'http2': ['httpx[http2]'],
+	},
 )
@@ -0,0 +1,758 @@
+"""
+Tests of the piapi module, run against a local HTTP server mimicking the data resources of the REST API.
+
+Run with: python -m unittest discover -s tests
+"""
+
+from __future__ import absolute_import
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import piapi  # noqa: E402
+
+"""
+Number of entities of the 'Clients' data resource of the test server
+"""
+CLIENTS_COUNT = 2345
+
+
+class PrimeHandler(BaseHTTPRequestHandler):
+    """
+    Request handler serving a 'Clients' data resource and a 'deleteDevices' service resource. Pages are sent with an
+    ETag computed from their content and 304 is answered to a matching If-None-Match header. The server counts the
+    429 answers left by first result of a page (rate_limited) and the 503 answers left by file name (unavailable).
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status=200, headers=()):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        server = self.server
+        path = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(path.query))
+        with server.lock:
+            server.hits.append((path.path, query, dict(self.headers)))
+        with server.lock:
+            if server.unavailable[os.path.basename(path.path)] > 0:
+                server.unavailable[os.path.basename(path.path)] -= 1
+                return self._send({}, 503, headers=[("Retry-After", "0")])
+        host = "http://%s" % self.headers["Host"]
+        if path.path.endswith("/data.json"):
+            return self._send({"queryResponse": {"entityType": [
+                {"$": "Clients", "@url": host + "/webacs/api/v3/data/Clients"}]}})
+        if path.path.endswith("/op.json"):
+            return self._send({"queryResponse": {"operation": [
+                {"$": "deleteDevices", "@httpMethod": "PUT", "@path": "devices/deleteDevices"}]}})
+        if not path.path.endswith("/data/Clients.json"):
+            return self._send({}, 404)
+
+        first_result = int(query.get(".firstResult", 0))
+        with server.lock:
+            if server.rate_limited[first_result] > 0:
+                server.rate_limited[first_result] -= 1
+                return self._send({}, 429, headers=[("Retry-After", "0")])
+        if server.delay:
+            time.sleep(server.delay)
+        ids = range(first_result, min(CLIENTS_COUNT, first_result + int(query.get(".maxResults", 100))))
+        entities = [{"@dtoType": "clientsDTO",
+                     "clientsDTO": {"@id": i, "macAddress": "mac%d%s" % (i, server.changes.get(i, ""))}}
+                    for i in ids]
+        query_response = {"@first": first_result, "@last": first_result + len(entities) - 1,
+                          "@count": CLIENTS_COUNT}
+        if entities:
+            query_response["entity"] = entities
+        etag = '"%s"' % hashlib.md5(json.dumps(query_response).encode("utf-8")).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._send({"queryResponse": query_response}, headers=[("ETag", etag)])
+
+
+    def do_PUT(self):
+        server = self.server
+        path = urllib.parse.urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.hits.append((path.path, body, dict(self.headers)))
+        if not path.path.endswith("/op/devices/deleteDevices.json"):
+            return self._send({}, 404)
+        self._send({"mgmtResponse": {"deleteDeviceResult": [{"deviceIp": ip} for ip in body["ipAddresses"]]}})
+
+
+class PrimeTestCase(unittest.TestCase):
+    """
+    Base test case starting the test server and a PIAPI instance connected to it.
+    """
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PrimeHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.hits = []
+        self.server.rate_limited = collections.Counter()
+        self.server.unavailable = collections.Counter()
+        self.server.changes = {}
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        self.api = piapi.PIAPI(self.url, "username", "password")
+
+    def tearDown(self):
+        self.api.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client_ids(self, entities):
+        return [entity["clientsDTO"]["@id"] for entity in entities]
+
+
+class ImapBoundedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+
+    def test_results_in_order(self):
+        def slow_identity(item):
+            time.sleep(0.001 * (item % 5))
+            return item
+
+        results = list(piapi._imap_bounded(self.executor, slow_identity, range(50), 4))
+        self.assertEqual(results, list(range(50)))
+
+    def test_bounded_in_flight(self):
+        lock = threading.Lock()
+        state = {"running": 0, "max": 0}
+
+        def tracked(item):
+            with lock:
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+            time.sleep(0.005)
+            with lock:
+                state["running"] -= 1
+            return item
+
+        self.assertEqual(list(piapi._imap_bounded(self.executor, tracked, range(30), 3)), list(range(30)))
+        self.assertLessEqual(state["max"], 3)
+
+    def test_iterable_pulled_lazily(self):
+        pulled = []
+
+        def items():
+            for item in range(100):
+                pulled.append(item)
+                yield item
+
+        results = piapi._imap_bounded(self.executor, lambda item: item, items(), 2)
+        self.assertEqual(next(results), 0)
+        self.assertLessEqual(len(pulled), 3)
+        results.close()
+
+    def test_pending_calls_cancelled_on_close(self):
+        started = []
+        release = threading.Event()
+
+        def blocking(item):
+            started.append(item)
+            release.wait(1)
+            return item
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            results = piapi._imap_bounded(executor, blocking, range(10), 3)
+            self.assertEqual(next(results), 0)
+            results.close()
+            release.set()
+        finally:
+            executor.shutdown(wait=True)
+        #  The item submitted after the first result and still queued is cancelled instead of being run
+        self.assertLess(len(started), 4)
+
+    def test_exception_propagated(self):
+        def failing(item):
+            if item == 3:
+                raise ValueError(item)
+            return item
+
+        with self.assertRaises(ValueError):
+            list(piapi._imap_bounded(self.executor, failing, range(10), 2))
+
+
+@unittest.skipIf(piapi.numpy is None, "NumPy is not installed")
+class ToArraysTest(unittest.TestCase):
+
+    def setUp(self):
+        self.entities = [{"clientsDTO": {"@id": 1, "rssi": -40}}, {"clientsDTO": {"@id": 2, "rssi": -72.5}}]
+
+    def test_columns(self):
+        columns = {"id": ("clientsDTO.@id", "i8"), "rssi": ("clientsDTO.rssi", "f4")}
+        arrays = piapi.to_arrays(iter(self.entities), columns)
+        self.assertEqual(arrays["id"].tolist(), [1, 2])
+        self.assertEqual(arrays["rssi"].dtype, piapi.numpy.float32)
+        self.assertEqual(arrays["rssi"].tolist(), [-40, -72.5])
+
+    def test_missing_field(self):
+        with self.assertRaises(piapi.PIAPIError):
+            piapi.to_arrays(self.entities, {"snr": ("clientsDTO.snr", "f4")})
+        arrays = piapi.to_arrays(self.entities, {"snr": ("clientsDTO.snr", "f4")}, default=0)
+        self.assertEqual(arrays["snr"].tolist(), [0, 0])
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_paced(self):
+        bucket = piapi.TokenBucket(2, 10)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.02)
+
+    def test_no_rate_limiting(self):
+        bucket = piapi.TokenBucket(1, None)
+        self.assertEqual([bucket.reserve() for _ in range(5)], [0] * 5)
+
+    def test_configure(self):
+        bucket = piapi.TokenBucket(5, 5)
+        bucket.configure(2, 1)
+        self.assertEqual((bucket.capacity, bucket.rate), (2, 1))
+        self.assertEqual([bucket.reserve() for _ in range(2)], [0, 0])
+        bucket.configure(10, None)
+        self.assertEqual(bucket.reserve(), 0)
+
+
+class ParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = piapi.PIAPI("http://127.0.0.1:1/", "username", "password")
+
+    def tearDown(self):
+        self.api.close()
+
+    def response(self, status_code, body=b"{}", headers=None):
+        response = requests.models.Response()
+        response.status_code = status_code
+        response._content = body
+        response.url = "http://127.0.0.1:1/webacs/api/v3/data/Clients.json"
+        response.headers.update(headers or {})
+        return response
+
+    def test_success(self):
+        self.assertEqual(self.api._parse(self.response(200, b'{"queryResponse": {}}')), {"queryResponse": {}})
+
+    def test_status_errors(self):
+        for status_code, message in piapi._STATUS_ERRORS.items():
+            with self.subTest(status_code=status_code):
+                with self.assertRaises(piapi.PIAPIRequestError) as context:
+                    self.api._parse(self.response(status_code))
+                self.assertEqual(str(context.exception), message % {"url": self.response(status_code).url})
+
+    def test_rate_limited(self):
+        with self.assertRaises(piapi.PIAPIRateLimited) as context:
+            self.api._parse(self.response(429, headers={"Retry-After": "7"}))
+        self.assertEqual(context.exception.retry_after, 7)
+        with self.assertRaises(piapi.PIAPIRateLimited) as context:
+            self.api._parse(self.response(503))
+        self.assertEqual(context.exception.retry_after, piapi.DEFAULT_RETRY_AFTER)
+
+    def test_invalid_request(self):
+        body = b'{"errorDocument": {"message": "Unknown field"}}'
+        with self.assertRaisesRegex(piapi.PIAPIRequestError, "Invalid request: Unknown field"):
+            self.api._parse(self.response(400, body))
+
+    def test_unknown_status(self):
+        with self.assertRaisesRegex(piapi.PIAPIRequestError, "return code is 418"):
+            self.api._parse(self.response(418))
+
+
+class WithFieldsTest(unittest.TestCase):
+
+    def test_fields(self):
+        params = {".sort": "macAddress"}
+        self.assertEqual(piapi._with_fields(params, ["macAddress", "rssi"]),
+                         {".sort": "macAddress", ".field": "macAddress,rssi"})
+        self.assertEqual(piapi._with_fields(params, "macAddress"), {".sort": "macAddress", ".field": "macAddress"})
+        self.assertIs(piapi._with_fields(params, None), params)
+        self.assertEqual(params, {".sort": "macAddress"})
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def test_params_order_ignored(self):
+        self.assertEqual(piapi._cache_key("Clients", {"a": 1, "b": {"c": 2, "d": 3}}),
+                         piapi._cache_key("Clients", {"b": {"d": 3, "c": 2}, "a": 1}))
+
+    def test_resource_and_params_distinguished(self):
+        key = piapi._cache_key("Clients", {"a": 1})
+        self.assertTrue(key.startswith("Clients:"))
+        self.assertNotEqual(key, piapi._cache_key("Clients", {"a": 2}))
+        self.assertNotEqual(key, piapi._cache_key("Devices", {"a": 1}))
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def make_cache(self, maxsize=3, ttl=60):
+        return piapi.LRUCache(maxsize, ttl)
+
+    def test_get_set(self):
+        cache = self.make_cache()
+        self.assertIsNone(cache.get("Clients:a"))
+        cache.set("Clients:a", [1, 2], etag=[1000, ['"x"']])
+        self.assertEqual(cache.get("Clients:a"), ([1, 2], [1000, ['"x"']], True))
+        self.assertIn("Clients:a", cache)
+        self.assertEqual(len(cache), 1)
+
+    def test_ttl(self):
+        cache = self.make_cache(ttl=60)
+        cache.set("Clients:stale", [1], ttl=-1)
+        cache.set("Clients:fresh", [2])
+        self.assertFalse(cache.get("Clients:stale")[2])
+        self.assertTrue(cache.get("Clients:fresh")[2])
+
+    def test_least_recently_used_evicted(self):
+        cache = self.make_cache(maxsize=2)
+        cache.set("Clients:a", [1])
+        time.sleep(0.01)
+        cache.set("Clients:b", [2])
+        time.sleep(0.01)
+        cache.get("Clients:a")
+        time.sleep(0.01)
+        cache.set("Clients:c", [3])
+        self.assertEqual(len(cache), 2)
+        self.assertIn("Clients:a", cache)
+        self.assertNotIn("Clients:b", cache)
+        self.assertIn("Clients:c", cache)
+
+    def test_clear_prefix(self):
+        cache = self.make_cache(maxsize=10)
+        cache.set("Clients:a", [1])
+        cache.set("Clients_2:a", [1])
+        cache.set("Devices:a", [2])
+        cache.clear("Clients:")
+        self.assertNotIn("Clients:a", cache)
+        self.assertIn("Clients_2:a", cache)
+        self.assertIn("Devices:a", cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class SQLiteCacheTest(LRUCacheTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.directory)
+
+    def make_cache(self, maxsize=3, ttl=60, namespace=""):
+        cache = piapi.SQLiteCache(os.path.join(self.directory, "cache.sqlite"), maxsize, ttl, namespace)
+        self.caches.append(cache)
+        return cache
+
+    def test_persisted(self):
+        self.make_cache().set("Clients:a", [{"b": 1}], etag=[1000, ['"x"']])
+        self.assertEqual(self.make_cache().get("Clients:a"), ([{"b": 1}], [1000, ['"x"']], True))
+
+    def test_namespaces(self):
+        first, second = self.make_cache(namespace="first"), self.make_cache(namespace="second")
+        first.set("Clients:a", [1])
+        self.assertNotIn("Clients:a", second)
+        second.clear()
+        self.assertIn("Clients:a", first)
+
+
+class RequestDataTest(PrimeTestCase):
+
+    def test_all_pages_in_order(self):
+        results = self.api.request_data("Clients", hold=0, paging_size=100)
+        self.assertEqual(self.client_ids(results), list(range(CLIENTS_COUNT)))
+
+    def test_single_page(self):
+        results = self.api.request_data("Clients", hold=0, paging_size=5000)
+        self.assertEqual(len(results), CLIENTS_COUNT)
+        self.assertEqual(len(self.server.hits), 2)
+
+    def test_unknown_resource(self):
+        with self.assertRaises(piapi.PIAPIResourceNotFound):
+            self.api.request_data("Unknown")
+
+    def test_cache_hit_returns_a_copy(self):
+        first = self.api.request_data("Clients", hold=0)
+        hits = len(self.server.hits)
+        first.clear()
+        second = self.api.request_data("Clients", hold=0)
+        self.assertEqual(len(second), CLIENTS_COUNT)
+        self.assertEqual(len(self.server.hits), hits)
+        self.assertIsNot(first, second)
+
+    def test_stale_result_revalidated_per_page(self):
+        api = piapi.PIAPI(self.url, "username", "password", cache_ttl=0)
+        api.request_data("Clients", hold=0)
+        hits = len(self.server.hits)
+        #  Only a later page changes, the first page still answers 304
+        self.server.changes[1500] = "-changed"
+        results = api.request_data("Clients", hold=0)
+        revalidated = self.server.hits[hits:]
+        self.assertTrue(all(headers.get("If-None-Match") for _, _, headers in revalidated))
+        self.assertEqual(results[1500]["clientsDTO"]["macAddress"], "mac1500-changed")
+        self.assertEqual(self.client_ids(results), list(range(CLIENTS_COUNT)))
+        api.close()
+
+    def test_fields_sent_and_cached_apart(self):
+        self.api.request_data("Clients", hold=0)
+        hits = len(self.server.hits)
+        self.api.request_data("Clients", hold=0, fields=["macAddress"])
+        self.assertTrue(self.server.hits[hits:])
+        self.assertTrue(all(query.get(".field") == "macAddress" for _, query, _ in self.server.hits[hits:]))
+
+    def test_single_field(self):
+        results = self.api.request_data("Clients", hold=0, fields="macAddress")
+        self.assertTrue(all(query.get(".field") == "macAddress"
+                            for path, query, _ in self.server.hits if path.endswith("/Clients.json")))
+        #  Same request as with a list of a single field
+        self.assertIs(self.api.request_data("Clients", hold=0, fields=["macAddress"])[0], results[0])
+
+    def test_rate_limited_pages_retried(self):
+        self.server.rate_limited.update({0, 1000})
+        with self.assertLogs("piapi", level="WARNING"):
+            results = self.api.request_data("Clients", hold=0)
+        self.assertEqual(self.client_ids(results), list(range(CLIENTS_COUNT)))
+
+    def test_rate_limited_page_retried_until_sent(self):
+        self.server.rate_limited.update({0: 2, 1000: 3})
+        with self.assertLogs("piapi", level="WARNING") as logs:
+            results = self.api.request_data("Clients", hold=0)
+        self.assertEqual(self.client_ids(results), list(range(CLIENTS_COUNT)))
+        self.assertEqual(len([record for record in logs.records if "rate limited" in record.getMessage()]), 5)
+
+    def test_rate_limited_retries_bounded(self):
+        self.server.rate_limited[0] = piapi.DEFAULT_RATE_LIMIT_RETRIES + 1
+        with self.assertLogs("piapi", level="WARNING"), self.assertRaises(piapi.PIAPIRateLimited):
+            self.api.request_data("Clients", hold=0)
+        self.assertEqual(len(self.server.hits), piapi.DEFAULT_RATE_LIMIT_RETRIES + 2)
+
+    def test_unavailable_resources_list_retried(self):
+        self.server.unavailable.update({"data.json": 1, "op.json": 2})
+        with self.assertLogs("piapi", level="WARNING"):
+            self.assertEqual(self.api.data_resources, ["Clients"])
+            self.assertEqual(self.api.service_resources, ["deleteDevices"])
+
+    def test_concurrent_requests_with_different_concurrency(self):
+        self.server.delay = 0.02
+        results = {}
+
+        def request(concurrent_requests):
+            try:
+                results[concurrent_requests] = len(self.api.request_data(
+                    "Clients", params={"n": concurrent_requests}, hold=0, paging_size=50,
+                    concurrent_requests=concurrent_requests))
+            except Exception as error:
+                results[concurrent_requests] = error
+
+        small = threading.Thread(target=request, args=(2,))
+        small.start()
+        time.sleep(0.2)
+        large = threading.Thread(target=request, args=(16,))
+        large.start()
+        small.join()
+        large.join()
+        self.assertEqual(results, {2: CLIENTS_COUNT, 16: CLIENTS_COUNT})
+
+    def test_adapter_not_remounted(self):
+        adapter = self.api.session.get_adapter(self.url)
+        self.api.request_data("Clients", hold=0, paging_size=50, concurrent_requests=32)
+        self.assertIs(self.api.session.get_adapter(self.url), adapter)
+        self.assertEqual(adapter._pool_maxsize, piapi._POOL_MAXSIZE)
+
+
+@unittest.skipIf(piapi.httpx is None, "httpx is not installed")
+class RequestDataHTTP2Test(RequestDataTest):
+    """
+    Same tests with the pages requested with httpx. The test server doesn't negotiate HTTP/2, httpx falls back to
+    HTTP/1.1.
+    """
+
+    def setUp(self):
+        super(RequestDataHTTP2Test, self).setUp()
+        self.api.close()
+        self.api = piapi.PIAPI(self.url, "username", "password", http2=True)
+
+    def test_pages_sent_with_httpx(self):
+        with self.assertLogs("piapi", level="WARNING") as logs:
+            self.api.request_data("Clients", hold=0)
+            self.api.request_data("Clients", params={"again": 1}, hold=0)
+        #  The fallback to HTTP/1.1 is reported once
+        self.assertEqual([record.getMessage() for record in logs.records],
+                         ["HTTP/2 not supported by the REST API, pages are requested over HTTP/1.1"])
+
+    def test_concurrent_pages_over_http1(self):
+        #  24 pages taking 0.1 second each, sent 8 at a time over as many HTTP/1.1 connections
+        self.server.delay = 0.1
+        start = time.monotonic()
+        with self.assertLogs("piapi", level="WARNING"):
+            self.api.request_data("Clients", hold=0, paging_size=100, concurrent_requests=8)
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertTrue(all(headers["User-Agent"].startswith("python-httpx")
+                            for path, _, headers in self.server.hits if path.endswith("/Clients.json")))
+
+
+class PersistentCacheTest(PrimeTestCase):
+
+    def setUp(self):
+        super(PersistentCacheTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.directory, "cache.sqlite")
+
+    def tearDown(self):
+        super(PersistentCacheTest, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def data_hits(self):
+        return [hit for hit in self.server.hits if hit[0].endswith("/Clients.json")]
+
+    def test_result_shared_across_instances(self):
+        api = piapi.PIAPI(self.url, "username", "password", cache_path=self.cache_path)
+        results = api.request_data("Clients", hold=0)
+        api.close()
+        hits = len(self.data_hits())
+        api = piapi.PIAPI(self.url, "username", "password", cache_path=self.cache_path)
+        self.assertEqual(api.request_data("Clients", hold=0), results)
+        self.assertEqual(len(self.data_hits()), hits)
+        #  Results are cached per user
+        other = piapi.PIAPI(self.url, "other", "password", cache_path=self.cache_path)
+        other.request_data("Clients", hold=0)
+        self.assertGreater(len(self.data_hits()), hits)
+        api.close()
+        other.close()
+
+    def test_stale_result_revalidated(self):
+        api = piapi.PIAPI(self.url, "username", "password", cache_path=self.cache_path, cache_ttl=0)
+        api.request_data("Clients", hold=0)
+        api.close()
+        hits = len(self.data_hits())
+        api = piapi.PIAPI(self.url, "username", "password", cache_path=self.cache_path, cache_ttl=0)
+        results = api.request_data("Clients", hold=0)
+        self.assertEqual(self.client_ids(results), list(range(CLIENTS_COUNT)))
+        self.assertTrue(all(headers.get("If-None-Match") for _, _, headers in self.data_hits()[hits:]))
+        api.close()
+
+
+class PacingTest(PrimeTestCase):
+
+    def test_strict_request_does_not_outlive_itself(self):
+        #  A strict data request (1 request every 0.2 second) then a lenient one (20 requests per second)
+        self.api.request_data("Clients", params={"strict": 1}, hold=0.2, concurrent_requests=1)
+        start = time.monotonic()
+        self.api.request_data("Clients", params={"lenient": 1}, hold=1, concurrent_requests=20, paging_size=200)
+        #  12 pages at 20 requests per second, instead of 2.4s at the strict rate
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_concurrent_requests_paced_together(self):
+        results = []
+
+        def request(concurrent_requests):
+            results.append(len(self.api.request_data("Clients", params={"n": concurrent_requests}, hold=1,
+                                                     concurrent_requests=concurrent_requests, paging_size=200)))
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=request, args=(concurrent_requests,)) for concurrent_requests in (4, 20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        #  24 pages sent at the strictest rate of 4 requests per second while both requests are running
+        self.assertEqual(results, [CLIENTS_COUNT, CLIENTS_COUNT])
+        self.assertGreater(time.monotonic() - start, 2)
+
+    def test_no_hold_not_paced(self):
+        with self.api._pacing(1, 10):
+            with self.api._pacing(5, 0) as bucket:
+                self.assertEqual([bucket.reserve() for _ in range(10)], [0] * 10)
+
+
+class CoalescingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = piapi.PIAPI("http://127.0.0.1:1/", "username", "password")
+        #  Resources are set instead of being requested from a REST API
+        self.api.__dict__["_data_resource_names"] = frozenset(["Clients"])
+        self.calls = 0
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.api.close()
+
+    def run_concurrently(self, count=4):
+        outcomes = []
+
+        def request():
+            try:
+                outcomes.append(self.api.request_data("Clients"))
+            except Exception as error:
+                outcomes.append(error)
+
+        threads = [threading.Thread(target=request) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_identical_requests_sent_once(self):
+        def fetch_data(*args):
+            self.calls += 1
+            self.release.wait(1)
+            return [{"id": 1}]
+
+        self.api._fetch_data = fetch_data
+        outcomes = self.run_concurrently()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, [[{"id": 1}]] * 4)
+        self.assertEqual(len({id(outcome) for outcome in outcomes}), 4)
+
+    def test_error_propagated_to_all_callers(self):
+        def fetch_data(*args):
+            self.calls += 1
+            self.release.wait(1)
+            raise piapi.PIAPIRequestError("failure")
+
+        self.api._fetch_data = fetch_data
+        outcomes = self.run_concurrently()
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(isinstance(outcome, piapi.PIAPIRequestError) for outcome in outcomes))
+        #  The failed request is not kept in flight, the next request is sent again
+        self.assertEqual(self.api._inflight, {})
+        self.api._fetch_data = lambda *args: [{"id": 2}]
+        self.assertEqual(self.api.request_data("Clients"), [{"id": 2}])
+
+
+@unittest.skipIf(piapi.httpx is None, "httpx is not installed")
+class RequestDataAsyncTest(PrimeTestCase):
+
+    def test_all_pages_in_order(self):
+        results = asyncio.run(self.api.request_data_async("Clients", hold=0, paging_size=300))
+        self.assertEqual(self.client_ids(results), list(range(CLIENTS_COUNT)))
+
+    def test_result_cached(self):
+        results = asyncio.run(self.api.request_data_async("Clients", hold=0))
+        hits = len(self.server.hits)
+        cached = asyncio.run(self.api.request_data_async("Clients", hold=0))
+        self.assertEqual(len(self.server.hits), hits)
+        self.assertEqual(cached, results)
+        self.assertIsNot(cached, results)
+        #  The result is shared with the synchronous data requests
+        self.assertEqual(self.api.request_data("Clients", hold=0), results)
+        self.assertEqual(len(self.server.hits), hits)
+
+    def test_unknown_resource(self):
+        with self.assertRaises(piapi.PIAPIResourceNotFound):
+            asyncio.run(self.api.request_data_async("Unknown"))
+
+    def test_rate_limited_pages_retried(self):
+        self.server.rate_limited.update({0: 2, 1000: 1})
+        with self.assertLogs("piapi", level="WARNING"):
+            results = asyncio.run(self.api.request_data_async("Clients", hold=0))
+        self.assertEqual(self.client_ids(results), list(range(CLIENTS_COUNT)))
+
+    def test_retry_gate_per_event_loop(self):
+        async def gates():
+            return self.api._get_async_retry_gate(), self.api._get_async_retry_gate()
+
+        first, same = asyncio.run(gates())
+        self.assertIs(first, same)
+        #  Each asyncio.run call runs a new event loop, the lock of the previous one can't be used anymore
+        second, _ = asyncio.run(gates())
+        self.assertIsNot(first, second)
+
+
+class RequestDataIterTest(PrimeTestCase):
+
+    def test_entities_in_order(self):
+        entities = self.api.request_data_iter("Clients", hold=0, paging_size=500)
+        self.assertEqual(self.client_ids(entities), list(range(CLIENTS_COUNT)))
+
+    def test_unknown_resource_raised_eagerly(self):
+        with self.assertRaises(piapi.PIAPIResourceNotFound):
+            self.api.request_data_iter("Unknown")
+
+    def test_keyword_only_arguments(self):
+        #  request_data takes check_cache as third argument, it would be taken as the virtual domain or the timeout
+        with self.assertRaises(TypeError):
+            self.api.request_data_iter("Clients", {}, False)
+        entities = self.api.request_data_iter("Clients", {}, virtual_domain="Campus", fields="macAddress", hold=0)
+        self.assertEqual(len(list(entities)), CLIENTS_COUNT)
+        self.assertEqual(self.server.hits[-1][1]["_ctx.domain"], "Campus")
+
+
+class RequestTest(PrimeTestCase):
+
+    def test_virtual_domain_not_leaked(self):
+        params = {".sort": "macAddress"}
+        self.api.request("Clients", params=params, virtual_domain="Campus", hold=0)
+        self.assertEqual(params, {".sort": "macAddress"})
+        self.assertEqual(self.server.hits[-1][1]["_ctx.domain"], "Campus")
+        self.api.request("Clients", params=params, hold=0)
+        self.assertNotIn("_ctx.domain", self.server.hits[-1][1])
+
+
+    def test_service_invalidates_cache(self):
+        self.api.request("Clients", hold=0)
+        hits = len(self.server.hits)
+        self.api.request("Clients", hold=0)
+        self.assertEqual(len(self.server.hits), hits)
+        response = self.api.request("deleteDevices", params={"ipAddresses": ["10.0.0.1"]})
+        self.assertEqual(response["mgmtResponse"]["deleteDeviceResult"], [{"deviceIp": "10.0.0.1"}])
+        hits = len(self.server.hits)
+        self.api.request("Clients", hold=0)
+        self.assertGreater(len(self.server.hits), hits)
+
+
+class ResourceAttributeTest(PrimeTestCase):
+
+    def test_attribute_is_a_request_shortcut(self):
+        clients = self.api.Clients
+        hits = len(self.server.hits)
+        self.assertIs(self.api.Clients, clients)
+        self.assertEqual(len(self.server.hits), hits)
+        self.assertEqual(len(clients(hold=0)), CLIENTS_COUNT)
+        self.assertFalse(hasattr(self.api, "Unknown"))
+
+
+if __name__ == "__main__":
+    unittest.main()